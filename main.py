@@ -1,4 +1,5 @@
 import asyncio
+import os
 from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
@@ -10,90 +11,134 @@ import ujson
 
 from parser import arguments
 from processing.image import compress_image
-from utils import getsize, convert_bytes, append_extension, log, is_image_by_url, create_directory
+from utils import convert_bytes, append_extension, log, is_image_by_url, create_directory, set_explicit, \
+    iter_media
 
+CHUNK_SIZE = 256 * 1024
+READ_BUFSIZE = 4 * 1024 * 1024
+WRITE_BUFFERING = 1024 * 1024
 
-async def write_file(_bytes: bytes, path: Path):
-    async with aiofiles.open(path, 'wb+') as file:
-        await file.write(_bytes)
-        await file.flush()
 
+async def stream_file(response: aiohttp.ClientResponse, path: Path) -> int:
+    written = 0
+    async with aiofiles.open(path, 'wb+', buffering=WRITE_BUFFERING) as file:
+        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            await file.write(chunk)
+            written += len(chunk)
 
-async def download_file(_url, folder, file_id=None) -> None:
-    create_directory(folder)
-    if not Path(f"{folder}/{file_id}_{_url}").exists() or getsize(Path(f"{folder}/{file_id}_{_url}"))['raw'] == 0:
-        async with semaphore, aiohttp.ClientSession(json_serialize=ujson.dumps,
-                                         headers={'Connection': 'keep-alive'}) as session:
-            async with session.get(f"https://telegra.ph/file/{_url}") as response:
-                assert response.status == 200
-
-                path = Path(f"{folder}/{file_id}_{_url}")
-                if parser.parse_args().compress:
-                    loop = asyncio.get_running_loop()
-                    executor = ProcessPoolExecutor()
-                    destination = append_extension(str(path), "webp")
-
-                    if not Path(destination).exists() or getsize(destination)['formatted'] == 0:
-                        if is_image_by_url(_url):
-                            await asyncio.gather(*[loop.run_in_executor(
-                                executor,
-                                compress_image,
-                                await response.read(),
-                                Path(destination)) if is_image_by_url(_url) else None])
-                        else:
-                            await write_file(await response.read(), path)
-                            log(f"[download] {file_id}_{_url} — {getsize(path)['formatted']}")
-
-                else:
-                    await write_file(await response.read(), path)
-                    log(f"[download] {file_id}_{_url} — {getsize(path)['formatted']}")
+    return written
 
 
-async def main():
-    async with aiohttp.ClientSession(json_serialize=ujson.dumps, headers={'Connection': 'keep-alive'}) as session:
-        async with session.get(
-                f"https://api.telegra.ph/getPage/{parser.parse_args().link.removeprefix('https://telegra.ph/')}",
-                params={'return_content': 'true'}
-        ) as response:
-            response = await response.json()
+async def read_body(response: aiohttp.ClientResponse) -> bytearray:
+    buffer = bytearray(response.content_length or 0)
+    offset = 0
+    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+        buffer[offset:offset + len(chunk)] = chunk
+        offset += len(chunk)
+    del buffer[offset:]
+
+    return buffer
+
 
-            old_size = getsize(parser.parse_args().folder)['raw']
-            start_time = datetime.now()
-            log([
-                f"[info] Started at: {datetime.now()}",
-                f"[download] {response['result']['title']}",
-            ])
+async def compress_worker(queue: asyncio.Queue[tuple[bytearray, Path] | None], executor: ProcessPoolExecutor) -> int:
+    loop = asyncio.get_running_loop()
+    saved = 0
+    while (item := await queue.get()) is not None:
+        _bytes, destination = item
+        await loop.run_in_executor(executor, compress_image, _bytes, destination)
+        saved += destination.stat().st_size
 
-            queue = response['result']['content']
-            files = []
+    return saved
 
-            while queue:
-                curr = queue.pop()
 
-                if "children" in curr and (nexts := curr["children"]) and isinstance(nexts, list):
-                    queue.extend(nexts)
+async def download_file(session: aiohttp.ClientSession, queue: asyncio.Queue[tuple[bytearray, Path] | None] | None,
+                        _url, folder, file_id=None) -> int:
+    path = folder / f"{file_id}_{_url}"
+    existing_size = path.stat().st_size if path.exists() else 0
+    compress = args.compress and is_image_by_url(_url)
+    if compress:
+        destination = append_extension(path, "webp")
+        if destination.exists() and destination.stat().st_size > 0:
+            return 0
 
-                if isinstance(curr, dict) and (curr["tag"] == "img" or curr["tag"] == "video"):
-                    files.append(curr['attrs']['src'])
+    url = f"https://telegra.ph/file/{_url}"
+    if existing_size:
+        async with session.head(url, allow_redirects=True) as response:
+            if response.status == 200 and existing_size == (response.content_length or existing_size):
+                return 0
 
-            urls = [filename.split('/')[-1] for filename in files[::-1]]
-            log(f"[info] Files in telegraph page: {len(urls)}")
+    async with session.get(url) as response:
+        assert response.status == 200
 
-            await asyncio.gather(*[download_file(
-                url,
-                parser.parse_args().folder,
-                file_id
-            ) for file_id, url in enumerate(urls)])
+        if compress:
+            await queue.put((await read_body(response), destination))
+            return 0
 
-            size = convert_bytes(getsize(parser.parse_args().folder)['raw'] - old_size)
-            log([
-                f"[download] Saved {size} to \"{parser.parse_args().folder}\"",
-                f"[info] Time elapsed: {datetime.now() - start_time}"
-            ])
+        written = await stream_file(response, path)
+        log(f"[download] {file_id}_{_url} — {convert_bytes(written)}")
+        return written
+
+
+async def main():
+    connector = aiohttp.TCPConnector(limit=50, limit_per_host=50, keepalive_timeout=75, ttl_dns_cache=300)
+    page_path = args.link.removeprefix('https://telegra.ph/').removeprefix('http://telegra.ph/')
+    executor = ProcessPoolExecutor(initializer=set_explicit, initargs=(args.explicit,))
+    with executor:
+        async with aiohttp.ClientSession(connector=connector, json_serialize=ujson.dumps, read_bufsize=READ_BUFSIZE,
+                                         headers={'Connection': 'keep-alive'}) as session:
+            async with session.get(
+                    f"https://api.telegra.ph/getPage/{page_path}",
+                    params={'return_content': 'true'}
+            ) as response:
+                response = await response.json(loads=ujson.loads)
+
+                start_time = datetime.now()
+                log([
+                    f"[info] Started at: {datetime.now()}",
+                    f"[download] {response['result']['title']}",
+                ])
+
+                urls = [src.rsplit('/', 1)[-1] for src in iter_media({'children': response['result']['content']})]
+                log(f"[info] Files in telegraph page: {len(urls)}")
+
+                create_directory(args.folder)
+                compress_workers = (os.cpu_count() or 1) if args.compress else 0
+                queue = asyncio.Queue(maxsize=2 * compress_workers) if args.compress else None
+
+                downloaded = 0
+
+                def on_download_done(task: asyncio.Task[int]) -> None:
+                    nonlocal downloaded
+                    semaphore.release()
+                    if not task.cancelled() and task.exception() is None:
+                        downloaded += task.result()
+
+                # Workers share the outer group with the downloads so a failure on either side cancels the rest
+                # instead of leaving them for asyncio.run() to clean up. A download task is only created once
+                # the semaphore has a free slot, so at most 50 of them exist at any time.
+                async with asyncio.TaskGroup() as tg:
+                    workers = [tg.create_task(compress_worker(queue, executor)) for _ in range(compress_workers)]
+
+                    async with asyncio.TaskGroup() as downloads:
+                        for file_id, url in enumerate(urls):
+                            await semaphore.acquire()
+                            downloads.create_task(
+                                download_file(session, queue, url, args.folder, file_id)
+                            ).add_done_callback(on_download_done)
+
+                    for _ in workers:
+                        await queue.put(None)
+
+                size = convert_bytes(downloaded + sum(worker.result() for worker in workers))
+                log([
+                    f"[download] Saved {size} to \"{args.folder}\"",
+                    f"[info] Time elapsed: {datetime.now() - start_time}"
+                ])
 
 
 if __name__ == '__main__':
-    parser = arguments()
+    args = arguments().parse_args()
+    set_explicit(args.explicit)
     semaphore = asyncio.Semaphore(50)
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy()) if platform == 'win32' else None
     asyncio.run(main())
@@ -5,8 +5,8 @@ import pyvips
 from utils import getsize, log
 
 
-def compress_image(_bytes: bytes, destination: Path) -> None:
-    image = pyvips.Image.new_from_buffer(_bytes, "")
+def compress_image(_bytes: bytes | bytearray, destination: Path) -> None:
+    image = pyvips.Image.new_from_buffer(_bytes, "", access="sequential")
     target = pyvips.Target.new_to_file(str(destination))
     image.write_to_target(target, ".webp", preset="photo", Q=80, smart_subsample=True)
 
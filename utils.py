@@ -1,17 +1,21 @@
+from collections import deque
+import os
 from pathlib import Path
-from parser import arguments
+from typing import Iterator
 import mimetypes
 
-parser = arguments()
+explicit = False
 
 
-IMAGE_FILE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.webp']
+IMAGE_FILE_EXTENSIONS = frozenset({'.jpg', '.jpeg', '.png', '.webp'})
+SIZE_UNITS = ('bytes', 'KB', 'MB', 'GB', 'TB')
 
-def convert_bytes(num: int) -> str | float:
-    for x in ['bytes', 'KB', 'MB', 'GB', 'TB']:
-        if num < 1024.0:
-            return f'{num:.2f} {x}'
-        num /= 1024.0
+
+def convert_bytes(num: int) -> str:
+    if num < 1024:
+        return f'{num:.2f} bytes'
+    unit = min((num.bit_length() - 1) // 10, len(SIZE_UNITS) - 1)
+    return f'{num / (1 << (10 * unit)):.2f} {SIZE_UNITS[unit]}'
 
 
 def getsize(path: Path) -> dict:
@@ -21,32 +25,51 @@ def getsize(path: Path) -> dict:
         if path.exists():
             raw_size = path.stat().st_size
             formatted_size = convert_bytes(raw_size)
-    else:
-        raw_size = sum(f.stat().st_size for f in path.glob('**/*') if f.is_file())
-        formatted_size = convert_bytes(raw_size)
 
     return {'raw': raw_size, 'formatted': formatted_size}
 
 
-def append_extension(path_string: str, extension: str) -> Path:
-    return Path(f"{''.join([path_string.removesuffix(ext) for ext in IMAGE_FILE_EXTENSIONS if path_string.endswith(ext)])}.{extension}")
+def append_extension(path: Path, extension: str) -> Path:
+    return path.with_suffix(f".{extension}")
 
 
 def is_image_by_url(path: Path) -> bool:
-    return any(str(path).endswith(ext) for ext in IMAGE_FILE_EXTENSIONS)
+    return os.path.splitext(str(path))[1].lower() in IMAGE_FILE_EXTENSIONS
+
+
+def iter_media(node: dict) -> Iterator[str]:
+    stack = deque([node])
+    while stack:
+        curr = stack.pop()
+        if isinstance(curr, dict):
+            if curr.get("tag") in ("img", "video"):
+                yield curr["attrs"]["src"]
+            if isinstance(children := curr.get("children"), list):
+                stack.extend(reversed(children))
 
 
 def create_directory(folder: Path):
     if not folder.exists():
         try:
-            Path(folder).mkdir(parents=True, exist_ok=True)
+            folder.mkdir(parents=True, exist_ok=True)
         except OSError:
             log(f"[os] Creation of the directory {folder} failed")
         else:
             log(f"[os] Successfully created the directory \"{folder}\"")
 
 
+def set_explicit(value: bool) -> None:
+    global explicit
+    explicit = value
+
+
 def log(data: str | list) -> None:
-    if parser.parse_args().explicit:
-        [print(message) for message in data] if isinstance(data, list) else print(data)
+    if not explicit:
+        return
+
+    if isinstance(data, list):
+        for message in data:
+            print(message)
+    else:
+        print(data)
 